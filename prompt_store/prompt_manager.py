@@ -1,14 +1,140 @@
 import yaml
 import os
+import copy
+import pickle
+import functools
+import mmap
+import re
+
+# Prefer the libyaml bindings when PyYAML was built with them
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _Dumper
+except ImportError:
+    from yaml import SafeLoader as _Loader, SafeDumper as _Dumper
+
+# Top-level keys start a new category section in the YAML file
+_SECTION_RE = re.compile(rb"^(?![\s#.-])([^:\n]+):", re.MULTILINE)
+
+def _version(yaml_file):
+    """
+    Identify the current contents of a YAML prompts file.
+
+    Args:
+        yaml_file (str): Absolute path of the YAML file.
+
+    Returns:
+        tuple: The modification time and size of the file, or None if it does not exist.
+    """
+    try:
+        st = os.stat(yaml_file)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def _index(data):
+    """
+    Map each top-level category of the YAML data to the (start, end) offsets of its section.
+    """
+    # Each section runs from its top-level key up to the next one
+    matches = list(_SECTION_RE.finditer(data))
+    sections = {}
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        category = match.group(1).decode().strip().strip("'\"")
+        sections[category] = (match.start(), next_match.start() if next_match else len(data))
+    return sections
+
+@functools.lru_cache(maxsize=4)
+def _load(yaml_file, version):
+    """
+    Index the categories of a YAML prompts file without parsing them.
+
+    The index maps each top-level category to the byte range of its section, so
+    single categories can be parsed on demand. It is cached in a pickle sidecar next
+    to the YAML file, keyed on the file's modification time and size, so the file is
+    only scanned again when it changes.
+
+    Args:
+        yaml_file (str): Absolute path of the YAML file.
+        version (tuple): The modification time and size of the file, as returned by _version.
+
+    Returns:
+        dict: A mapping from category name to the (start, end) offsets of its section.
+    """
+    if version is None:
+        return {}
+
+    cache_file = yaml_file + ".pkl"
+
+    # Reuse the cached index if the YAML file has not changed since it was stored
+    try:
+        with open(cache_file, 'rb') as file:
+            mtime_ns, size, sections = pickle.load(file)
+        if (mtime_ns, size) == version:
+            return sections
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+        pass
+
+    with open(yaml_file, 'rb') as file:
+        data = file.read()
+        st = os.fstat(file.fileno())
+    sections = _index(data)
+
+    # Write the sidecar atomically so concurrent readers never see a partial file
+    try:
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as file:
+            pickle.dump((st.st_mtime_ns, st.st_size, sections), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"Could not write the prompts cache: {e}")
+
+    return sections
+
+@functools.lru_cache(maxsize=32)
+def _load_category(yaml_file, version, category):
+    """
+    Parse the prompts of a single category from a YAML file.
+
+    Args:
+        yaml_file (str): Absolute path of the YAML file.
+        version (tuple): The modification time and size of the file, as returned by _version.
+        category (str): The category to parse.
+
+    Returns:
+        list: The prompts of the category, shared by every caller; they must not be modified.
+
+    Raises:
+        KeyError: If the category does not exist.
+    """
+    with open(yaml_file, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # The offsets are only valid for the contents they were computed from, so the
+        # mapped file is indexed again if it changed since the version was taken
+        st = os.fstat(file.fileno())
+        if (st.st_mtime_ns, st.st_size) == version:
+            sections = _load(yaml_file, version)
+        else:
+            sections = _index(mm)
+        start, end = sections[category]
+        section = yaml.load(mm[start:end], Loader=_Loader)
+    return section[category]
+
+def invalidate():
+    """
+    Drop the in-process prompts cache so the next load reads the YAML file again.
+    """
+    _load_category.cache_clear()
+    _load.cache_clear()
 
 class PromptManager:
     def __init__(self):
         """
         Initialize the PromptManager with the YAML file.
+
+        Categories are parsed from the file the first time they are accessed.
         """
         file_dir = os.path.dirname(__file__)
         self.yaml_file = os.path.abspath(os.path.join(file_dir, "..", "config", "prompts.yaml"))
-        self.prompts = self.load_prompts()
+        self.prompts = {}
 
     def load_prompts(self):
         """
@@ -18,18 +144,45 @@ class PromptManager:
             dict: The dictionary containing prompts loaded from the file. If the file
                   does not exist, it returns a dictionary with an empty "document_metadata" list.
         """
-        if os.path.exists(self.yaml_file):
-            with open(self.yaml_file, 'r') as file:
-                return yaml.safe_load(file)
-        else:
+        version = _version(self.yaml_file)
+        sections = _load(self.yaml_file, version)
+        if not sections:
             return {"document_metadata": []}
+        # The parsed categories are shared by the whole process, so callers get their own copy
+        return {category: copy.deepcopy(_load_category(self.yaml_file, version, category)) for category in sections}
+
+    def _category(self, category):
+        """
+        Get the prompts of a category, parsing it from the YAML file on first access.
+
+        Args:
+            category (str): The category of prompts to get.
+
+        Returns:
+            list: The prompts in the specified category.
+
+        Raises:
+            KeyError: If the category does not exist.
+        """
+        if category not in self.prompts:
+            version = _version(self.yaml_file)
+            if category not in _load(self.yaml_file, version):
+                raise KeyError(category)
+            # Each instance edits its own copy, never the prompts cached for the whole process
+            self.prompts[category] = copy.deepcopy(_load_category(self.yaml_file, version, category))
+        return self.prompts[category]
 
     def save_prompts(self):
         """
         Save the current state of the prompts back to the YAML file.
         """
+        # Parse the categories that were never accessed so they are not lost
+        prompts = {category: self._category(category) for category in _load(self.yaml_file, _version(self.yaml_file))}
+        prompts.update(self.prompts)
         with open(self.yaml_file, 'w') as file:
-            yaml.dump(self.prompts, file)
+            yaml.dump(prompts, file, Dumper=_Dumper)
+        self.prompts = prompts
+        invalidate()
 
     def list_prompts(self, category):
         """
@@ -41,7 +194,10 @@ class PromptManager:
         Returns:
             list: A list of all the prompts in the specified category.
         """
-        return self.prompts.get(category, [])
+        try:
+            return self._category(category)
+        except KeyError:
+            return []
 
     def add_prompt(self, category, new_prompt):
         """
@@ -51,9 +207,11 @@ class PromptManager:
             category (str): The category to which the prompt will be added.
             new_prompt (str): The template text of the new prompt to be added.
         """
-        if category not in self.prompts:
-            self.prompts[category] = []
-        self.prompts[category].append({"template": new_prompt})
+        try:
+            prompts = self._category(category)
+        except KeyError:
+            prompts = self.prompts[category] = []
+        prompts.append({"template": new_prompt})
         self.save_prompts()
         print(f"Prompt added successfully to category '{category}'.")
 
@@ -67,7 +225,7 @@ class PromptManager:
             updated_prompt (str): The new content to replace the existing prompt.
         """
         try:
-            self.prompts[category][index]["template"] = updated_prompt
+            self._category(category)[index]["template"] = updated_prompt
             self.save_prompts()
             print(f"Prompt in category '{category}' edited successfully.")
         except (IndexError, KeyError):
@@ -82,7 +240,7 @@ class PromptManager:
             index (int): The index of the prompt to delete.
         """
         try:
-            self.prompts[category].pop(index)
+            self._category(category).pop(index)
             self.save_prompts()
             print(f"Prompt deleted successfully from category '{category}'.")
         except (IndexError, KeyError):
@@ -101,7 +259,7 @@ class PromptManager:
             None: If no prompt is found at the given index.
         """
         try:
-            return self.prompts[category][index]["template"]
+            return self._category(category)[index]["template"]
         except (IndexError, KeyError):
             print(f"No prompt found at index {index} in category '{category}'.")
             return None
@@ -1,19 +1,71 @@
 # Importing libraries
 import os
 import re
+import asyncio
+import contextlib
 import difflib
+import functools
+import itertools
+import httpx
+import hashlib
+import shelve
+import threading
+import orjson
 from openai import AzureOpenAI
 from langchain_community.document_loaders import PyPDFLoader
+from pypdf.errors import PyPdfError
 from langchain_openai import AzureChatOpenAI
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from pydantic import BaseModel, Field
 from typing import List
-from collections import Counter
+from collections import Counter, deque
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from prompt_store.prompt_manager import PromptManager
 
+# Persistent cache of the metadata extracted by the language model
+_METADATA_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "databases", "metadata_cache")
+# Serializes the accesses to the metadata cache, which are made from several threads
+_METADATA_CACHE_LOCK = threading.Lock()
+# Deployment of the chat model that extracts the metadata of the papers
+_CHAT_DEPLOYMENT = "gpt4-turbo"
+# Connections kept by the HTTP clients of the chat model
+_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+# File extensions handled as papers
+_PDF_EXTENSIONS = frozenset({".pdf"})
+
+# Start of the 'Abstract' or 'Introduction' section, or of the 'References' section
+_SECTIONS_RE = re.compile(
+    r"(?P<start>Abstract|Resumen|Introduction|Introducción)|(?P<end>References|Bibliography|Referencias)",
+    re.IGNORECASE
+)
+# Start of the 'References' section
+_REFS_RE = re.compile(r"References|Bibliography|Referencias", re.IGNORECASE)
+# Sentence-ending punctuation followed by the start of the next sentence. The
+# whitespace in between is captured so sentences are sliced without lookarounds.
+_SENT_RE = re.compile(r'[.!?](\s+)[A-Z0-9]')
+# Separators between the authors in the information dictionary of a PDF
+_AUTHORS_SEP_RE = re.compile(r"\s*;\s*|\s+and\s+")
+# Titles that the producing software writes instead of the title of the paper
+_JUNK_TITLE_RE = re.compile(r"^(?:Microsoft Word\s*-|untitled\b)|\.(?:docx?|pdf|tex|dvi|rtf|odt)$", re.IGNORECASE)
+# Publication year on the first page of a paper
+_YEAR_RE = re.compile(r'\b(?:19|20)\d{2}\b')
+# End of a paragraph: a period followed by single or double newlines
+_PARA_RE = re.compile(r'\.\s*\n')
+# Paragraphs starting with "Figura", "Table", "Figure", or "Fig."
+_FIG_RE = re.compile(r'^(Figura|Table|Figure|Fig)\s*\d+\.', re.IGNORECASE)
+# Paragraphs to skip: figure or table captions, and citations
+_SKIP_RE = re.compile(
+    r"^(?:(?:Figura|Table|Figure|Fig)\s*\d+\."  # Caption starting with "Figura", "Table", "Figure", or "Fig."
+    r"|\s*(?:\d+\.\s*)?"                       # Or citation: optional number and period at the start
+    r".*?"                                      # Any characters (non-greedy)
+    r"\(\d{4}\)\.?\s*$)",                      # Year in parentheses at the end, optional period, end of string
+    re.IGNORECASE | re.DOTALL
+)
+
 class PaperProcessor(BaseModel):
     """
     Model for processing the scientific article information.
@@ -24,188 +76,150 @@ class PaperProcessor(BaseModel):
 
     paper_processed: list = Field("The list containing the title, authors, year and citation.")
 
-class Preprocessor:
-    def __init__(self, directory_path):
-        self.directory_path = directory_path
-        self.pdf_files = []
-        self.other_files = []
-        self.data = []  
-
-        model_params = {
-            "azure_endpoint": os.getenv("OPENAI_ENDPOINT"),
-            "api_key":os.getenv("NEXT_API_KEY"),
-            "api_version":os.getenv("OPENAI_API_VERSION"),
-            "tiktoken_model_name": "gpt4-turbo",
-            "azure_deployment": "gpt4-turbo",
-            "temperature" : 0
-        }
-
-        self.client = AzureOpenAI(
-            api_version=os.getenv("OPENAI_API_VERSION"),
-            azure_endpoint=os.getenv("OPENAI_ENDPOINT"),
-            api_key=os.getenv("NEXT_API_KEY")
-        )
-
-        self.langchain_client = AzureChatOpenAI(**model_params)
-        self.prompt_manager = PromptManager()
+@functools.lru_cache(maxsize=128)
+def _normalize_citation(citation):
+    """
+    Normalizing the spaces of a citation and obtaining its set of lowercase words.
+    """
+    words = citation.split()
+    return " ".join(words), frozenset(word.lower() for word in words)
 
-    def enumerate_files(self):
-        """
-        Listing and classifying files based on its extension.
-        """
-        for root, dirs, files in os.walk(self.directory_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if file.endswith(".pdf"):
-                    self.pdf_files.append(file_path)
-                else:
-                    self.other_files.append(file_path)
-    def remove_headers_and_footers(self, text, all_texts):
-        """
-        Remove repetitive headers and footers based on common first and last lines across multiple pages.
+class PaperTextProcessor:
+    """
+    Text processing of the pages of a paper.
+
+    It holds no clients, so it can be used in worker processes.
+    """
+
+    def find_headers_and_footers(self, first_lines, last_lines):
         """
-        # Split the text into lines
-        lines = text.split("\n")
+        Find the repetitive header and footer of a paper as the most common first and last lines of its pages.
 
-        # Get the first and last lines of all pages
-        first_lines = [doc.split("\n")[0] for doc in all_texts if doc.split("\n")]
-        last_lines = [doc.split("\n")[-1] for doc in all_texts if doc.split("\n")]
+        Args:
+            first_lines (List[str]): The first line of each page.
+            last_lines (List[str]): The last line of each page.
 
+        Returns:
+            tuple: The stripped header and footer.
+        """
         # Find the most common first and last lines (potential headers and footers)
         common_first = Counter(first_lines).most_common(1)[0][0]
         common_last = Counter(last_lines).most_common(1)[0][0]
 
-        # Remove the header if it matches the common first line
-        if lines[0].strip() == common_first.strip():
-            lines = lines[1:]
+        return common_first.strip(), common_last.strip()
 
-        # Remove the footer if it matches the common last line
-        if lines[-1].strip() == common_last.strip():
-            lines = lines[:-1]
+    def remove_headers_and_footers(self, text, header, footer):
+        """
+        Remove the header and footer found by find_headers_and_footers from the text of a page.
+        """
+        # Remove the header if it matches the first line
+        first_line, _, rest = text.partition("\n")
+        if first_line.strip() == header:
+            text = rest
 
-        # Rebuild the cleaned text
-        cleaned_text = "\n".join(lines)
+        # Remove the footer if it matches the last line
+        rest, _, last_line = text.rpartition("\n")
+        if last_line.strip() == footer:
+            text = rest
 
-        return cleaned_text
+        return text
 
-    def process_pdfs(self):
-        """
-        Processing PDF files
+    def extract_sentences_from_pages(self, pages, header, footer):
         """
-        # Looping over all pdf files
-        print(f"The list contains {len(self.pdf_files)} files")
-        for pdf_file in self.pdf_files:
-            # Instantiating the pdf loader
-            loader = PyPDFLoader(pdf_file)
-            # Loading the document
-            documents = loader.load()
-            print(f"There are {len(documents)} documents")
-            # Obtaining metadata about the paper
-            title, authors, year, citation = self.extract_metadata_from_document(documents[0].page_content[0:1000])
-            # Get the text of all documents for detecting headers and footers
-            all_texts = [doc.page_content for doc in documents]
-            # Processing documents in the paper
-            for document in documents:
-                # Obtaining the text
-                text = document.page_content
-                # Remove headers and footers
-                cleaned_text = self.remove_headers_and_footers(text, all_texts)
-                # Parsing text from Abstract or introduction
-                parsed_text, stop_processing = self.parse_from_abstract_or_introduction(cleaned_text, citation)
-                if parsed_text:
-                    # Dividing the text into sentences and attaching the metadata to it
-                    self.extract_sentences_and_metadata(parsed_text, title, authors, year, citation)
-                if stop_processing:
-                    print("Stopping further document processing as final section is detected.")
-                    break  # Detener el bucle interno de documentos
-            
-            # # If stop_processing is True, stop processing other PDFs as well
-            # if stop_processing:
-            #     print("Stopping processing of further PDFs.")
-            #     break  # Detener el bucle externo de PDFs
+        Obtaining the sentences of the pages of a paper together with their phrase
+        number, as (phrase_number, sentence) pairs
 
-    def extract_metadata_from_document(self, document):
+        Pages can be any iterable of page texts, so they can be streamed; no page
+        is read after the final section is detected.
         """
-        Extracting metadata from paper
-        """
-        # Defining variables
-        title = None
-        authors = []
-        year = None
-        citation = None
-
-        # Getting prompt
-        template_str = self.prompt_manager.get_prompt("document_metadata",0)
-        # Creating prompt template
-        prompt_template = PromptTemplate(
-            template = template_str,
-            input_variables = ["document"],
-            partial_variables={"format_instructions":JsonOutputParser(pydantic_object=PaperProcessor).get_format_instructions()}
-        )
-        # Defining the classification chain
-        classification_chain = prompt_template | self.langchain_client | JsonOutputParser(pydantic_object = PaperProcessor)
-
-        try:
-            # Invoking the classification chain 
-            output = classification_chain.invoke({"document": document})
-        except Exception as e:
-            # Raising runtime error
-            print(e)
-            raise RuntimeError(F"Error while parsing the paper author information")
-        
-        # Obtaining information about the paper
-        title, authors, year, citation = output["Title"], output["Authors"], output["Year"], output["Citation"]
+        sentences = []
+        in_body = False
+        # Processing the text of the documents in the paper
+        for text in pages:
+            # Remove headers and footers
+            cleaned_text = self.remove_headers_and_footers(text, header, footer)
+            # Parsing text from Abstract or introduction, as parse_from_abstract_or_introduction does;
+            # once the section has started only the references are searched for on later pages
+            match_start, match_end = self.find_sections(cleaned_text, in_body)
+            if match_start or in_body:
+                in_body = True
+                start = match_start.start() if match_start else 0
+                end = match_end.start() if match_end else len(cleaned_text)
+                parsed_text = cleaned_text[start:end]
+            else:
+                parsed_text = cleaned_text
+            stop_processing = match_end is not None
+            if parsed_text:
+                # Dividing the text into sentences, numbered from the start of each page
+                page_sentences = self.split_into_filtered_sentences(parsed_text)
+                sentences.extend(enumerate(page_sentences, 1))
+            if stop_processing:
+                print("Stopping further document processing as final section is detected.")
+                break  # Detener el bucle interno de documentos
+        return sentences
 
-        return(title, authors, year, citation)
-    
     # Function to measure similarity between two strings
     def is_own_citation(self, citation, own_citation, threshold):
-        # Normalize spaces and compare
-        citation_normalized = " ".join(citation.split())
-        own_citation_normalized = " ".join(own_citation.split())
-
-        print(f"comparing own citation with: {citation_normalized}")
-        
-        # Calculate similarity ratio using difflib
-        similarity_ratio = difflib.SequenceMatcher(None, citation_normalized, own_citation_normalized).ratio()
+        # Normalize spaces and tokenize; the own citation is the same for a whole paper
+        citation_normalized, citation_tokens = _normalize_citation(citation)
+        own_citation_normalized, own_citation_tokens = _normalize_citation(own_citation)
+
+        # Cheap word overlap to settle the clear cases without a full comparison
+        union = citation_tokens | own_citation_tokens
+        jaccard = len(citation_tokens & own_citation_tokens) / max(1, len(union))
+        if jaccard < threshold - 0.15:
+            return False
+        if jaccard > threshold + 0.1:
+            return True
+
+        # Calculate similarity ratio using difflib; autojunk would discard the
+        # characters that repeat the most in citations and skew the ratio
+        similarity_ratio = difflib.SequenceMatcher(None, citation_normalized, own_citation_normalized, autojunk=False).ratio()
 
-        print(f"Similarity ratio: {similarity_ratio}")
-        
         return similarity_ratio > threshold
 
-    
-    def parse_from_abstract_or_introduction(self, text, own_citation, threshold=0.8):
+    def find_sections(self, text, in_body=False):
+        """
+        Find the start of the 'Abstract' or 'Introduction' section and the start of the
+        'References' section in a single scan of the text.
+
+        Parameters:
+        text (str): The text in which to search.
+        in_body (bool): Whether the 'Abstract' or 'Introduction' was found on an earlier page,
+            in which case only the 'References' section is searched for.
+
+        Returns:
+        tuple: The first match of each section, or None for the ones not found.
+        """
+        if in_body:
+            return None, _REFS_RE.search(text)
+
+        match_start = None
+        match_end = None
+        for match in _SECTIONS_RE.finditer(text):
+            if match.lastgroup == "start":
+                match_start = match_start or match
+            else:
+                match_end = match_end or match
+            if match_start and match_end:
+                break
+        return match_start, match_end
+
+    def parse_from_abstract_or_introduction(self, text, own_citation=None, threshold=0.8):
         """
         Find 'Abstract' or 'Introduction' and return text from there until 'References'.
         Ignore citations that are too similar to the paper's own citation.
         
         Parameters:
         text (str): The text from which to parse.
-        own_citation (str): The citation of the own paper that should be ignored.
+        own_citation (str, optional): The citation of the own paper that should be ignored.
         threshold (float): A similarity threshold between 0 and 1 to consider a citation as the own citation.
         
         Returns:
         tuple: The parsed text and a flag indicating if processing should stop at a citation.
         """
-        # Define regex patterns for the sections 'Abstract', 'Introduction', 'References'
-        abstract_regex = re.compile(r"(Abstract|Resumen|Introduction|Introducción)", re.IGNORECASE)
-        # Modified references regex to capture spaces and newlines around "References"
-        references_regex = re.compile(r"(References|Bibliography|Referencias)", re.IGNORECASE)
-
-        # Find the start of the 'Abstract' or 'Introduction' section
-        match_start = abstract_regex.search(text)
-        match_end = references_regex.search(text)
-        
-        # Find the start of the 'References' section
-        stop_processing = False
-        possible_endings = []
-
-        if match_end:
-            possible_endings.append(match_end)
-        
-        if possible_endings:
-            match_end = min(possible_endings, key=lambda x: x.start())
-            stop_processing = True
+        match_start, match_end = self.find_sections(text)
+        stop_processing = match_end is not None
 
         # If both 'Abstract' or 'Introduction' and 'References' are found
         if match_start and match_end:
@@ -224,10 +238,13 @@ class Preprocessor:
         Split text into sentences based on typical sentence-ending punctuation (., !, ?) 
         followed by a space and a capital letter or a digit at the start of the next sentence.
         """
-        # Defining a regex pattern for extracting proper sentences
-        sentence_endings = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9])')
-        # Spliting text into proper sentences
-        sentences = sentence_endings.split(text)
+        # Spliting text into proper sentences at the whitespace between them
+        sentences = []
+        start = 0
+        for match in _SENT_RE.finditer(text):
+            sentences.append(text[start:match.start(1)])
+            start = match.end(1)
+        sentences.append(text[start:])
         return sentences
     
     def split_into_paragraphs(self, text):
@@ -235,16 +252,23 @@ class Preprocessor:
         Split text into paragraphs based on single or double newlines, which typically 
         indicate the separation between paragraphs in a block of text.
         """
-        # Defining a regex pattern that handles both single and double newlines
-        paragraph_endings = re.compile(r'\.\s*\n')
-
-        # Split the text where the pattern is found
-        paragraphs = paragraph_endings.split(text.strip())
+        return list(self.iter_paragraphs(text))
 
-        # Optionally, remove empty paragraphs or trim leading/trailing spaces
-        paragraphs = [p.strip() for p in paragraphs if p.strip()]
-        
-        return paragraphs
+    def iter_paragraphs(self, text):
+        """
+        Lazily yield the stripped, non-empty paragraphs of the text, as split_into_paragraphs.
+        """
+        # Yield the text between the places where the pattern is found
+        text = text.strip()
+        start = 0
+        for match in _PARA_RE.finditer(text):
+            paragraph = text[start:match.start()].strip()
+            if paragraph:
+                yield paragraph
+            start = match.end()
+        paragraph = text[start:].strip()
+        if paragraph:
+            yield paragraph
     
     def remove_figure_or_table_paragraphs(self, paragraphs):
         """
@@ -257,58 +281,485 @@ class Preprocessor:
         Returns:
             List[str]: Filtered list of paragraphs without figure or table references.
         """
-        # Regular expression to match paragraphs starting with "Figura", "Table", "Figure", or "Fig."
-        pattern = re.compile(r'^(Figura|Table|Figure|Fig)\s*\d+\.', re.IGNORECASE)
-        
         # Filter out paragraphs that match the pattern
-        filtered_paragraphs = [para for para in paragraphs if not pattern.match(para.strip())]
+        filtered_paragraphs = [para for para in paragraphs if not _FIG_RE.match(para.strip())]
         
         return filtered_paragraphs
     
+    def split_into_filtered_sentences(self, text):
+        """
+        Split text into sentences, dropping figure or table captions and citations
+        """
+        # Split text and keep the sentences that are neither captions nor citations
+        return (sentence for sentence in self.iter_paragraphs(text) if not _SKIP_RE.match(sentence))
+
+def _process_single_pdf(pdf_file):
+    """
+    Loading a PDF file and extracting the sentences of its pages.
+
+    Defined at module level so it can be sent to worker processes. The metadata
+    of the paper is obtained afterwards by the parent process. The PDF is parsed
+    once, keeping only the text of each page.
+
+    Returns:
+        tuple: The text of the first page, the metadata of the first page and the
+               (phrase_number, sentence) pairs of the paper.
+        None: If the file cannot be read as a PDF or has no pages.
+    """
+    processor = PaperTextProcessor()
+    # Files that cannot be read as PDFs are skipped; any other error is raised
+    try:
+        # Instantiating the pdf loader
+        loader = PyPDFLoader(pdf_file)
+
+        # Keeping only the text of each page, and the metadata of the first one
+        pages = []
+        for document in loader.lazy_load():
+            if not pages:
+                info = document.metadata
+            pages.append(document.page_content)
+    except (PyPdfError, OSError, ValueError) as e:
+        print(f"Skipping {pdf_file}: {e}")
+        return None
+    print(f"There are {len(pages)} documents")
+    if not pages:
+        print(f"Skipping {pdf_file}: no pages found")
+        return None
+
+    # Detecting the headers and footers once for all pages
+    first_lines = [page.partition("\n")[0] for page in pages]
+    last_lines = [page.rpartition("\n")[2] for page in pages]
+    header, footer = processor.find_headers_and_footers(first_lines, last_lines)
+    return pages[0], info, processor.extract_sentences_from_pages(pages, header, footer)
+
+def _apa_author(name):
+    """
+    Writing an author name as 'Last name, First initial.', the format asked to the language model
+    """
+    # Names are either "Last, First Middle" or "First Middle Last"
+    if "," in name:
+        last, _, first = name.partition(",")
+        first_names = first.split()
+    else:
+        *first_names, last = name.split()
+    initials = " ".join("-".join(part[0] + "." for part in first_name.split("-") if part) for first_name in first_names)
+    return f"{last.strip()}, {initials}" if initials else last.strip()
+
+def _metadata_key(document, meta_chain):
+    """
+    Key of the metadata of a paper in the disk cache, from the hash of its text
+
+    The prompt template and the model deployment are hashed too, so that editing the
+    prompt or changing the model does not keep serving metadata extracted with the old ones.
+    """
+    key = hashlib.blake2b(digest_size=16)
+    key.update(meta_chain.first.template.encode())
+    key.update(b"\0" + _CHAT_DEPLOYMENT.encode())
+    key.update(b"\0" + document.encode())
+    return key.hexdigest()
+
+def _cached_metadata(key):
+    """
+    Metadata stored in the disk cache under the key, or None if it was never extracted
+    """
+    with _METADATA_CACHE_LOCK, shelve.open(_METADATA_CACHE) as cache:
+        return cache.get(key)
+
+def _store_metadata(key, output):
+    """
+    Storing the metadata returned by the language model in the disk cache
+    """
+    # Obtaining information about the paper
+    metadata = (output["Title"], output["Authors"], output["Year"], output["Citation"])
+    with _METADATA_CACHE_LOCK, shelve.open(_METADATA_CACHE) as cache:
+        cache[key] = metadata
+    return metadata
+
+@contextlib.contextmanager
+def _metadata_errors():
+    """
+    Turning the errors of the language model into a RuntimeError
+    """
+    try:
+        yield
+    except Exception as e:
+        # Raising runtime error
+        print(e)
+        raise RuntimeError(F"Error while parsing the paper author information") from e
+
+def _new_chat_client(**http_clients):
+    """
+    Chat model client using the given pooled HTTP clients.
+    """
+    model_params = {
+        "azure_endpoint": os.getenv("OPENAI_ENDPOINT"),
+        "api_key":os.getenv("NEXT_API_KEY"),
+        "api_version":os.getenv("OPENAI_API_VERSION"),
+        "tiktoken_model_name": _CHAT_DEPLOYMENT,
+        "azure_deployment": _CHAT_DEPLOYMENT,
+        "temperature" : 0,
+        **http_clients
+    }
+    return AzureChatOpenAI(**model_params)
+
+@functools.lru_cache(maxsize=1)
+def _chat_client():
+    """
+    Chat model client shared by all Preprocessor instances for synchronous calls.
+
+    The client keeps a pool of HTTP connections alive, so the TLS handshake with
+    Azure is not repeated for every Preprocessor.
+    """
+    return _new_chat_client(http_client=httpx.Client(limits=_HTTP_LIMITS))
+
+@functools.lru_cache(maxsize=1)
+def _openai_client():
+    """
+    Azure OpenAI client shared by all Preprocessor instances.
+    """
+    return AzureOpenAI(
+        api_version=os.getenv("OPENAI_API_VERSION"),
+        azure_endpoint=os.getenv("OPENAI_ENDPOINT"),
+        api_key=os.getenv("NEXT_API_KEY")
+    )
+
+@functools.lru_cache(maxsize=1)
+def _prompt_manager():
+    """
+    Prompt manager shared by all Preprocessor instances.
+    """
+    return PromptManager()
+
+def _build_metadata_chain(chat_client):
+    """
+    Chain that extracts the metadata of a paper with the given chat model client.
+    """
+    output_parser = JsonOutputParser(pydantic_object=PaperProcessor)
+    prompt_template = PromptTemplate(
+        template = _prompt_manager().get_prompt("document_metadata",0),
+        input_variables = ["document"],
+        partial_variables={"format_instructions":output_parser.get_format_instructions()}
+    )
+    return prompt_template | chat_client | output_parser
+
+@functools.lru_cache(maxsize=1)
+def _metadata_chain():
+    """
+    Chain that extracts the metadata of a paper, built once for all Preprocessor instances.
+    """
+    return _build_metadata_chain(_chat_client())
+
+@contextlib.asynccontextmanager
+async def _async_metadata_chain():
+    """
+    Chain that extracts the metadata of a paper with async connections of the running loop.
+
+    Async connections cannot outlive the event loop that opened them, so every loop
+    gets its own pool of connections, closed once the loop is done with it.
+    """
+    async with httpx.AsyncClient(limits=_HTTP_LIMITS) as http_async_client:
+        yield _build_metadata_chain(_new_chat_client(http_async_client=http_async_client))
+
+class Preprocessor(PaperTextProcessor):
+    def __init__(self, directory_path):
+        self.directory_path = directory_path
+        self.pdf_files = []
+        self.other_files = []
+        # Sentences are stored column-wise; the metadata shared by every sentence of
+        # a paper is kept once in self.papers and referenced through self.paper_ids
+        self.sentences = []
+        self.paper_ids = array('i')
+        self.phrase_numbers = array('i')
+        self.papers = []
+
+        self.client = _openai_client()
+        self.langchain_client = _chat_client()
+        self.prompt_manager = _prompt_manager()
+        self._meta_chain = _metadata_chain()
+
+    @property
+    def data(self):
+        """
+        List of dictionaries with every sentence and its metadata.
+        """
+        papers_metadata = self._papers_metadata()
+        return [
+            {"sentence": sentence, "metadata": {**papers_metadata[paper_id], "phrase_number": phrase_number}}
+            for sentence, paper_id, phrase_number in zip(self.sentences, self.paper_ids, self.phrase_numbers)
+        ]
+
+    def _papers_metadata(self):
+        """
+        Building the metadata shared by all the sentences of each paper
+        """
+        return [
+            {"title": title, "authors": authors, "year": year, "citation_format_x": citation}
+            for title, authors, year, citation in self.papers
+        ]
+
+    def enumerate_files(self):
+        """
+        Listing and classifying files based on its extension.
+        """
+        # Walking the tree with a stack of directories, mirroring os.walk: symbolic links to
+        # directories are neither listed nor followed, and unreadable directories are skipped
+        stack = [self.directory_path]
+        while stack:
+            subdirectories = []
+            files = []
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        if not is_dir:
+                            files.append(entry)
+                        elif not entry.is_symlink():
+                            subdirectories.append(entry.path)
+            except OSError:
+                continue
+            for entry in files:
+                if os.path.splitext(entry.name)[1] in _PDF_EXTENSIONS:
+                    self.pdf_files.append(entry.path)
+                else:
+                    self.other_files.append(entry.path)
+            # Visiting subdirectories in the same order as os.walk
+            stack.extend(reversed(subdirectories))
+
+    def process_pdfs(self, max_concurrency=20):
+        """
+        Processing PDF files
+
+        The metadata of the papers is requested concurrently, with at most
+        max_concurrency calls to the language model in flight at once. From a
+        running event loop, such as a notebook, use aprocess_pdfs instead.
+        """
+        # Looping over all pdf files
+        print(f"The list contains {len(self.pdf_files)} files")
+        for paper, sentences in self._iter_papers(max_concurrency):
+            self._add_paper(paper, sentences)
+
+    async def aprocess_pdfs(self, max_concurrency=20):
+        """
+        Processing PDF files on the running event loop, as process_pdfs does
+        """
+        # Looping over all pdf files
+        print(f"The list contains {len(self.pdf_files)} files")
+        async for paper, sentences in self._aiter_papers(max_concurrency):
+            self._add_paper(paper, sentences)
+
+    def iter_process_pdfs(self, max_concurrency=20):
+        """
+        Processing PDF files one paper at a time, without storing the results.
+
+        Yields:
+            List[Dict]: The sentences of a paper with their metadata, in the same
+                        format as the data attribute.
+        """
+        for (title, authors, year, citation), sentences in self._iter_papers(max_concurrency):
+            metadata = {"title": title, "authors": authors, "year": year, "citation_format_x": citation}
+            yield [
+                {"sentence": sentence, "metadata": {**metadata, "phrase_number": phrase_number}}
+                for phrase_number, sentence in sentences
+            ]
+
+    def _iter_papers(self, max_concurrency):
+        """
+        Running _aiter_papers on an event loop of its own, for synchronous callers
+        """
+        # The papers cannot be awaited from here if an event loop is already running
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("PDF files cannot be processed synchronously inside a running event loop, use aprocess_pdfs instead")
+
+        # A single event loop is used for all papers, so the async connections
+        # opened by the chat client are reused instead of tied to a closed loop
+        loop = asyncio.new_event_loop()
+        papers = self._aiter_papers(max_concurrency)
+        try:
+            while True:
+                try:
+                    paper = loop.run_until_complete(papers.__anext__())
+                except StopAsyncIteration:
+                    return
+                yield paper
+        finally:
+            # Cancelling the papers left if the caller stops iterating early
+            loop.run_until_complete(papers.aclose())
+            loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
+
+    async def _aiter_papers(self, max_concurrency):
+        """
+        Processing the PDF files with at most max_concurrency papers in flight and
+        yielding the metadata and sentences of each paper in their original order
+        """
+        pdf_files = iter(self.pdf_files)
+        # Decoding and splitting the PDFs is CPU bound, so it is spread across processes,
+        # and all papers share the async connections of this loop to the language model
+        async with _async_metadata_chain() as meta_chain:
+            with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+                pending = deque(
+                    asyncio.create_task(self._process_one(pdf_file, pool, meta_chain))
+                    for pdf_file in itertools.islice(pdf_files, max_concurrency)
+                )
+                try:
+                    while pending:
+                        # The other papers keep progressing while waiting for the oldest one
+                        paper = await pending.popleft()
+                        # Starting the next paper as soon as one is finished
+                        next_pdf_file = next(pdf_files, None)
+                        if next_pdf_file is not None:
+                            pending.append(asyncio.create_task(self._process_one(next_pdf_file, pool, meta_chain)))
+                        if paper is not None:
+                            yield paper
+                finally:
+                    # Cancelling the papers left on errors or if the caller stops iterating early,
+                    # and collecting their results so that their errors are not reported again
+                    for task in pending:
+                        task.cancel()
+                    await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _process_one(self, pdf_file, pool, meta_chain):
+        """
+        Extracting the sentences of a PDF file and obtaining the metadata of the paper,
+        or None if the file cannot be read
+        """
+        # Loading the document and extracting its sentences in a worker process
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(pool, _process_single_pdf, pdf_file)
+        if result is None:
+            return None
+        first_page, info, sentences = result
+        # Obtaining metadata about the paper, asking the model only if the PDF does not provide it
+        metadata = self.extract_metadata_from_pdf_info(first_page, info)
+        if metadata is None:
+            metadata = await self.aextract_metadata_from_document(first_page[0:1000], meta_chain)
+        return metadata, sentences
+
+    def _add_paper(self, paper, sentences):
+        """
+        Appending the sentences of a paper to the data columns
+        """
+        # Registering the paper once for all of its pages
+        if not self.papers or self.papers[-1] != paper:
+            self.papers.append(paper)
+        paper_id = len(self.papers) - 1
+
+        # Extending each column in bulk instead of appending sentence by sentence
+        columns = tuple(zip(*sentences))
+        if not columns:
+            return
+        phrase_numbers, paper_sentences = columns
+        self.sentences.extend(paper_sentences)
+        self.phrase_numbers.extend(phrase_numbers)
+        self.paper_ids.extend(itertools.repeat(paper_id, len(paper_sentences)))
+
+    def extract_metadata_from_pdf_info(self, first_page, info):
+        """
+        Extracting metadata from the information dictionary of the PDF file
+
+        Args:
+            first_page (str): The text of the first page of the paper.
+            info (dict): The metadata of the first page, as returned by the PDF loader.
+
+        Returns:
+            tuple: The title, authors, year and citation of the paper.
+            None: If the PDF does not provide a usable title, the authors and a year on the first page.
+        """
+        title = (info.get("title") or "").strip()
+        author = (info.get("author") or "").strip()
+        year_match = _YEAR_RE.search(first_page)
+        # Titles set by the producing software, such as "Microsoft Word - draft.docx", are left to the model
+        if not (title and author and year_match) or _JUNK_TITLE_RE.search(title):
+            return None
+
+        # Authors are separated by semicolons or "and"; a comma separates the last name from
+        # the first names of an author, so authors are written as the model writes them
+        authors = [_apa_author(name) for name in _AUTHORS_SEP_RE.split(author) if name.strip()]
+        year = int(year_match.group())
+
+        # Building an APA-like citation from the available information
+        names = authors[0] if len(authors) == 1 else ", ".join(authors[:-1]) + ", & " + authors[-1]
+        citation = f"{names} ({year}). {title}."
+
+        return(title, authors, year, citation)
+
+    def extract_metadata_from_document(self, document):
+        """
+        Extracting metadata from paper
+
+        Results are cached on disk by the hash of the document text.
+        """
+        # Reusing the metadata of papers that were already processed
+        key = _metadata_key(document, self._meta_chain)
+        metadata = _cached_metadata(key)
+        if metadata is not None:
+            return metadata
+
+        with _metadata_errors():
+            # Invoking the classification chain 
+            output = self._meta_chain.invoke({"document": document})
+
+        return _store_metadata(key, output)
+
+    async def aextract_metadata_from_document(self, document, meta_chain=None):
+        """
+        Extracting metadata from paper without blocking the event loop
+
+        meta_chain is a chain from _async_metadata_chain opened on the running loop;
+        without it, one is opened for this call only.
+        """
+        if meta_chain is None:
+            async with _async_metadata_chain() as meta_chain:
+                return await self.aextract_metadata_from_document(document, meta_chain)
+
+        # Reusing the metadata of papers that were already processed; the disk cache
+        # is accessed from a thread so it does not block the event loop
+        key = _metadata_key(document, meta_chain)
+        metadata = await asyncio.to_thread(_cached_metadata, key)
+        if metadata is not None:
+            return metadata
+
+        with _metadata_errors():
+            # Invoking the classification chain 
+            output = await meta_chain.ainvoke({"document": document})
+
+        return await asyncio.to_thread(_store_metadata, key, output)
+
     def extract_sentences_and_metadata(self, text, title, authors, year, citation):
         """
         Split text into sentences and attach metadata
         """
-        # Split text and filter out
-        sentences = self.split_into_paragraphs(text) 
-        sentences = self.remove_figure_or_table_paragraphs(sentences) 
-        
-        # Updated citation regex pattern
-        citation_regex = re.compile(
-            r"^\s*(?:\d+\.\s*)?"  # Optional number and period at the start
-            r".*?"                # Any characters (non-greedy)
-            r"\(\d{4}\)\.?\s*$",  # Year in parentheses at the end, optional period, end of string
-            re.DOTALL             # Dot matches newlines
-        )
-        
-        phrase_number = 1
-        # Loop over all sentences
-        for sentence in sentences:
-            cleaned_sentence = sentence.strip()
-            # If sentence is not empty and doesn't match the citation pattern
-            if cleaned_sentence and not citation_regex.match(cleaned_sentence):
-                # Create metadata structure 
-                metadata = {
-                    "title": title,
-                    "authors": authors,
-                    "year": year,
-                    "citation_format_x": citation,
-                    "phrase_number": phrase_number
-                }
-                # Append it to the data structure
-                self.data.append({"sentence": cleaned_sentence, "metadata": metadata})
-                phrase_number += 1
-
-
-    def save_data(self, output_file):
-        """
-        Guarda los datos procesados en un archivo de salida.
-        """
-        with open(output_file, 'w') as f:
-            for entry in self.data:
-                f.write(f"Sentence: {entry['sentence']}\n")
-                f.write(f"Metadata: {entry['metadata']}\n")
-                f.write("\n")
+        sentences = self.split_into_filtered_sentences(text)
+        self._add_paper((title, authors, year, citation), enumerate(sentences, 1))
+
+    def save_data(self, output_file, papers=None):
+        """
+        Guarda los datos procesados en un archivo de salida, una entrada JSON por línea.
+
+        Args:
+            output_file (str): Path of the output file.
+            papers (Iterable[List[Dict]], optional): Papers to write as they are produced,
+                such as the ones yielded by iter_process_pdfs. Defaults to the stored data.
+        """
+        with open(output_file, 'wb', buffering=1 << 20) as f:
+            if papers is not None:
+                # Writing each paper as soon as it is available
+                for paper in papers:
+                    f.writelines(orjson.dumps(entry) + b"\n" for entry in paper)
+                return
+
+            papers_metadata = self._papers_metadata()
+            f.writelines(
+                orjson.dumps({"sentence": sentence, "metadata": {**papers_metadata[paper_id], "phrase_number": phrase_number}}) + b"\n"
+                for sentence, paper_id, phrase_number in zip(self.sentences, self.paper_ids, self.phrase_numbers)
+            )
 
 
 if __name__ == "__main__":
@@ -1,11 +1,34 @@
 # Importing libraries
 import os
 from langchain_community.vectorstores import FAISS
-from langchain.schema import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
 from langchain_openai.embeddings import AzureOpenAIEmbeddings
-from openai import AzureOpenAI
-from typing import List, Dict
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from typing import List, Dict, Union
+from collections import Counter
 import ast
+import asyncio
+import math
+import faiss
+import numpy as np
+import orjson
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.utils import aget_embeddings_vectors, get_vector_id
+
+# Azure OpenAI deployment shared by the embeddings clients
+AZURE_OPENAI_ENDPOINT = "https://genai-nexus.api.corpinter.net/apikey/"
+AZURE_OPENAI_API_VERSION = "2024-02-01"
+# Number of sentences sent in each embeddings request
+EMBEDDING_BATCH_SIZE = 512
+# Maximum number of embeddings requests in flight at once
+EMBEDDING_MAX_CONCURRENCY = 8
+# Corpora with at least this many sentences are stored in an IVF index with float16 vectors
+IVF_MIN_VECTORS = 10000
+# Flags to memory-map a saved index read-only: IO_FLAG_MMAP maps the inverted lists of IVF
+# indexes and IO_FLAG_MMAP_IFC (faiss >= 1.11) the codes of flat indexes
+INDEX_MMAP_FLAGS = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
 
 class EmbeddingDBFromData:
     """
@@ -18,27 +41,27 @@ class EmbeddingDBFromData:
         data_list (List[Dict]): List of dictionaries containing sentences and metadata.
     """
 
-    def __init__(self, index_name: str, data_variable: str):
+    def __init__(self, index_name: str, data_variable: Union[str, List[Dict]]):
         """
         Initializes the EmbeddingDBFromData with the index name and data variable.
 
         Args:
             index_name (str): The name of the index.
-            data_variable (str): The string representation of the data containing sentences and metadata.
+            data_variable (Union[str, List[Dict]]): The data containing sentences and metadata, or its JSON or string representation.
         """
         self.index_name = index_name
 
         # Initialize Azure OpenAI Embeddings
         self.embeddings = AzureOpenAIEmbeddings(
             model='text-embedding-ada-002',
-            api_version="2024-02-01",
-            azure_endpoint="https://genai-nexus.api.corpinter.net/apikey/",
+            api_version=AZURE_OPENAI_API_VERSION,
+            azure_endpoint=AZURE_OPENAI_ENDPOINT,
             openai_api_type="azure",
             api_key=os.getenv("OPENAI_ADA")
         )
         self.client = AzureOpenAI(
-            api_version="2024-02-01",
-            azure_endpoint="https://genai-nexus.api.corpinter.net/apikey/",
+            api_version=AZURE_OPENAI_API_VERSION,
+            azure_endpoint=AZURE_OPENAI_ENDPOINT,
             api_key=os.getenv("OPENAI_ADA")
         )
 
@@ -47,34 +70,132 @@ class EmbeddingDBFromData:
 
     def parse_data_variable(self) -> List[Dict]:
         """
-        Parses the data_variable string into a list of dictionaries.
+        Parses the data_variable into a list of dictionaries.
+
+        The data_variable can already be a list, a JSON array, JSON Lines as written by
+        Preprocessor.save_data, or the string representation of a Python list.
 
         Returns:
             List[Dict]: The parsed data list.
         """
-        # Use ast.literal_eval to safely evaluate the string as a Python literal
-        data_list = ast.literal_eval(self.data_variable)
-        return data_list
+        data = self.data_variable
+        if isinstance(data, list):
+            return data
+
+        try:
+            # A single JSON array, or one JSON object per line
+            if data.lstrip().startswith('['):
+                return orjson.loads(data)
+            return [orjson.loads(line) for line in data.splitlines() if line.strip()]
+        except orjson.JSONDecodeError:
+            # Use ast.literal_eval to safely evaluate the string as a Python literal
+            return ast.literal_eval(data)
 
     def create_embeddings_and_index(self):
         """
         Creates embeddings for each sentence and stores them in the FAISS index.
+
+        Runs acreate_embeddings_and_index on an event loop of its own; from a running
+        event loop, such as a notebook, await acreate_embeddings_and_index instead.
+        """
+        # The embeddings cannot be awaited from here if an event loop is already running
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("create_embeddings_and_index cannot run inside a running event loop, use acreate_embeddings_and_index instead")
+        asyncio.run(self.acreate_embeddings_and_index())
+
+    async def acreate_embeddings_and_index(self):
         """
-        
-        documents = []
-        for item in self.data_variable:
+        Creates embeddings for each sentence and stores them in the FAISS index, on the running event loop.
+
+        Each distinct sentence is embedded once, in batches of EMBEDDING_BATCH_SIZE inputs per request
+        with up to EMBEDDING_MAX_CONCURRENCY requests in flight. Corpora of IVF_MIN_VECTORS sentences
+        or more are stored in an IVF index with float16 vectors.
+        """
+        # Give every sentence a stable id; sentences that repeat with the same metadata,
+        # such as boilerplate at the same position on several pages, are numbered
+        ids = []
+        sentences = []
+        metadatas = []
+        occurrences = Counter()
+        for item in self.parse_data_variable():
             sentence = item.get('sentence', '')
             metadata = item.get('metadata', {})
-            # Create a Document object with sentence and metadata
-            doc = Document(page_content=sentence, metadata=metadata)
-            documents.append(doc)
+            vector_id = get_vector_id(sentence, metadata)
+            occurrences[vector_id] += 1
+            if occurrences[vector_id] > 1:
+                vector_id = f"{vector_id}-{occurrences[vector_id] - 1}"
+            ids.append(vector_id)
+            sentences.append(sentence)
+            metadatas.append(metadata)
+
+        # Embed each distinct sentence once, in batches to keep each request under the size limits
+        unique_sentences = list(dict.fromkeys(sentences))
+        unique_vectors = await self.aembed_sentences(unique_sentences)
+        sentence_vectors = dict(zip(unique_sentences, unique_vectors))
+        vectors = [sentence_vectors[sentence] for sentence in sentences]
+
+        # Create the FAISS index from the precomputed embeddings in a single add
+        self.index = FAISS.from_embeddings(
+            text_embeddings=list(zip(sentences, vectors)),
+            embedding=self.embeddings,
+            metadatas=metadatas,
+            ids=ids
+        )
+
+        # Large corpora: swap the flat float32 index for an IVF one that stores float16 vectors
+        if len(vectors) >= IVF_MIN_VECTORS:
+            self.index.index = self.build_ivf_index(np.asarray(vectors, dtype=np.float32))
+
+    async def aembed_sentences(self, sentences: List[str]) -> List[List[float]]:
+        """
+        Embeds the sentences with concurrent batched requests to Azure OpenAI.
 
-        # Create the FAISS index from documents using embeddings
-        self.index = FAISS.from_documents(documents, self.embeddings)
+        Args:
+            sentences (List[str]): The sentences to embed.
+
+        Returns:
+            List[List[float]]: The embeddings vectors, in the order of the sentences.
+        """
+        # The async client is bound to the running event loop, so it lives only for this call
+        async with AsyncAzureOpenAI(
+            api_version=AZURE_OPENAI_API_VERSION,
+            azure_endpoint=AZURE_OPENAI_ENDPOINT,
+            api_key=os.getenv("OPENAI_ADA")
+        ) as client:
+            return await aget_embeddings_vectors(client, sentences, EMBEDDING_BATCH_SIZE, EMBEDDING_MAX_CONCURRENCY)
+
+    @staticmethod
+    def build_ivf_index(vectors: np.ndarray) -> faiss.Index:
+        """
+        Builds an IVF index with float16 scalar quantization from the given vectors.
+
+        Vectors are added in order, so positions match the ones of the flat index they replace.
+
+        Args:
+            vectors (np.ndarray): The (n, dimension) float32 embedding matrix.
+
+        Returns:
+            faiss.Index: The trained IVF index containing all the vectors.
+        """
+        n, dimension = vectors.shape
+        nlist = min(256, max(4, int(math.sqrt(n))))
+        quantizer = faiss.IndexFlatL2(dimension)
+        index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+        index.train(vectors)
+        index.add(vectors)
+        index.nprobe = min(nlist, 16)
+        return index
 
     def save_index_locally(self) -> bool:
         """
-        Saves the current index to a local file.
+        Saves the current index to a local folder.
+
+        The FAISS index is written with faiss.write_index so that it can be memory-mapped
+        on load, and the documents are stored next to it as JSON instead of a pickle.
 
         Returns:
             bool: True if successful, False otherwise.
@@ -83,8 +204,16 @@ class EmbeddingDBFromData:
             # Define the path to save the index
             save_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",'databases', self.index_name)
             if self.index:
-                # Save the index locally
-                self.index.save_local(save_path)
+                # Save the raw index and the documents in the order of its vectors
+                os.makedirs(save_path, exist_ok=True)
+                faiss.write_index(self.index.index, os.path.join(save_path, "index.faiss"))
+                documents = []
+                for position in range(len(self.index.index_to_docstore_id)):
+                    doc_id = self.index.index_to_docstore_id[position]
+                    doc = self.index.docstore.search(doc_id)
+                    documents.append({'id': doc_id, 'sentence': doc.page_content, 'metadata': doc.metadata})
+                with open(os.path.join(save_path, "docstore.json"), 'wb') as f:
+                    f.write(orjson.dumps(documents))
             else:
                 print("No index to save.")
                 return False
@@ -95,7 +224,13 @@ class EmbeddingDBFromData:
 
     def load_existing_index(self) -> bool:
         """
-        Loads an existing index from a local file.
+        Loads an existing index from a local folder.
+
+        The FAISS index is memory-mapped read-only, so its vectors are paged in by the OS
+        on demand: the inverted lists of IVF indexes with IO_FLAG_MMAP, and the codes of
+        flat indexes with IO_FLAG_MMAP_IFC, which needs faiss 1.11 or later (older versions
+        read flat indexes into memory). Indexes saved with FAISS.save_local (index.pkl) are
+        still loaded.
 
         Returns:
             bool: True if successful, False otherwise.
@@ -103,8 +238,24 @@ class EmbeddingDBFromData:
         try:
             # Define the path to load the index
             load_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",'databases', self.index_name)
-            # Load the index from the local path
-            self.index = FAISS.load_local(load_path, self.embeddings, allow_dangerous_deserialization=True)
+            docstore_path = os.path.join(load_path, "docstore.json")
+            if not os.path.exists(docstore_path):
+                # Load an index saved by LangChain from the local path
+                self.index = FAISS.load_local(load_path, self.embeddings, allow_dangerous_deserialization=True)
+                return True
+
+            # Map the index and rebuild the docstore from the documents
+            index = faiss.read_index(os.path.join(load_path, "index.faiss"), INDEX_MMAP_FLAGS)
+            with open(docstore_path, 'rb') as f:
+                documents = orjson.loads(f.read())
+            self.index = FAISS(
+                embedding_function=self.embeddings,
+                index=index,
+                docstore=InMemoryDocstore({
+                    doc['id']: Document(page_content=doc['sentence'], metadata=doc['metadata']) for doc in documents
+                }),
+                index_to_docstore_id={position: doc['id'] for position, doc in enumerate(documents)}
+            )
             return True
         except Exception as e:
             print(f"Exception occurred while loading the index: {e}")
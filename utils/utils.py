@@ -1,6 +1,7 @@
 # Importing libraries
-from openai import AzureOpenAI
-import json
+from openai import AzureOpenAI, AsyncAzureOpenAI, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+import asyncio
 import hashlib
 
 def get_embeddings_vector(client: AzureOpenAI, string: str) -> list:
@@ -24,9 +25,47 @@ def get_embeddings_vector(client: AzureOpenAI, string: str) -> list:
         model='text-embedding-ada-002',
     )
     
-    # Parse the response and return the embedding
-    response_json = json.loads(response.model_dump_json(indent=2))
-    return response_json['data'][0]['embedding']
+    # The response is already parsed, read the embedding straight from it
+    return response.data[0].embedding
+
+
+@retry(
+    retry=retry_if_exception_type(RateLimitError),
+    wait=wait_exponential_jitter(max=60),
+    stop=stop_after_attempt(8),
+    reraise=True
+)
+async def _aembed_batch(client: AsyncAzureOpenAI, semaphore: asyncio.Semaphore, batch: list) -> list:
+    """
+    Requests the embeddings of a batch of strings, backing off and retrying when rate limited.
+    """
+    # The semaphore is released while waiting to retry, so other batches can go ahead
+    async with semaphore:
+        response = await client.embeddings.create(
+            input=batch,
+            model='text-embedding-ada-002',
+        )
+    return [item.embedding for item in response.data]
+
+async def aget_embeddings_vectors(client: AsyncAzureOpenAI, strings: list, batch_size: int = 256, max_concurrency: int = 8) -> list:
+    """
+    Retrieves the embeddings vectors for a list of strings using OpenAI, with several batched requests in flight.
+    
+    Args:
+        client (AsyncAzureOpenAI): Async Azure OpenAI client.
+        strings (list): The input strings to get embeddings for.
+        batch_size (int): The number of strings sent in each request.
+        max_concurrency (int): The maximum number of requests in flight at once.
+        
+    Returns:
+        list: The resulting embeddings vectors, in the order of the input strings.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    batches = await asyncio.gather(*(
+        _aembed_batch(client, semaphore, strings[start:start + batch_size])
+        for start in range(0, len(strings), batch_size)
+    ))
+    return [vector for batch in batches for vector in batch]
 
 
 def get_vector_id(sentence: str, metadata: dict) -> str:
@@ -45,4 +84,11 @@ def get_vector_id(sentence: str, metadata: dict) -> str:
     if not isinstance(metadata, dict):
         raise ValueError("The argument 'metadata' must be a dictionary.")
     
-   
\ No newline at end of file
+    # The title and citation identify the paper and the phrase number the sentence within
+    # it; the fields are separated so that shifting characters between them changes the hash
+    vector_hash = hashlib.blake2b(digest_size=16)
+    vector_hash.update(sentence.encode())
+    vector_hash.update(b"\0" + str(metadata.get("title", "")).encode())
+    vector_hash.update(b"\0" + str(metadata.get("citation_format_x", "")).encode())
+    vector_hash.update(b"\0" + str(metadata.get("phrase_number", 0)).encode())
+    return vector_hash.hexdigest()